@@ -1,8 +1,7 @@
 
 import my_sx1262
-# import asyncio
+import asyncio
 
-# asyncio.run(my_sx1262.main())
-my_sx1262.pin_dio1.irq(my_sx1262.dio_echo_irq, trigger=my_sx1262.Pin.IRQ_RISING)
-# my_sx1262.pin_dio1.irq(my_sx1262.dio_strobe_irq, trigger=my_sx1262.Pin.IRQ_RISING)
-my_sx1262.main()
\ No newline at end of file
+my_sx1262.set_dio_handler(my_sx1262.dio_echo_irq)
+# my_sx1262.set_dio_handler(my_sx1262.dio_strobe_irq)
+asyncio.run(my_sx1262.main())
\ No newline at end of file
@@ -0,0 +1,8 @@
+# Freeze the driver into MicroPython firmware so its bytecode and constants
+# live in flash instead of being compiled into RAM at import:
+#   make -C ports/rp2 BOARD=RPI_PICO FROZEN_MANIFEST=/path/to/pico_lora/manifest.py
+# main.py stays on the filesystem.
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("my_sx1262.py", opt=3)
+module("scratch.py", opt=3)
@@ -19,16 +19,49 @@ https://www.raspberrypi.com/documentation/microcontrollers/raspberry-pi-pico.htm
 """
 
 import machine
-from machine import Pin, SPI, Timer
+import micropython
+from micropython import const
+from machine import Pin, SPI
 import time
 import asyncio
+import struct
+import rp2
+
+# SX1262 opcodes
+_OP_GET_STATUS = const(0xc0)
+_OP_SET_PACKET_TYPE = const(0x8a)
+_OP_WRITE_BUFFER = const(0x0e)
+_OP_READ_BUFFER = const(0x1e)
+_OP_SET_BUFFER_BASE_ADDR = const(0x8f)
+_OP_SET_PA_CONFIG = const(0x95)
+_OP_SET_TX_PARAMS = const(0x8e)
+_OP_SET_PACKET_PARAMS = const(0x8c)
+_OP_SET_MODULATION_PARAMS = const(0x8b)
+_OP_SET_TX = const(0x83)
+_OP_SET_RX = const(0x82)
+_OP_SET_STANDBY = const(0x80)
+_OP_GET_DEVICE_ERRORS = const(0x17)
+_OP_CLEAR_DEVICE_ERRORS = const(0x07)
+_OP_SET_REGULATOR_MODE = const(0x96)
+_OP_SET_RF_FREQUENCY = const(0x86)
+_OP_GET_IRQ_STATUS = const(0x12)
+_OP_CLEAR_IRQ_STATUS = const(0x02)
+_OP_SET_DIO_IRQ_PARAMS = const(0x08)
+_OP_SET_DIO2_AS_RF_SWITCH_CTRL = const(0x9d)
+_OP_SET_DIO3_AS_TCXO_CTRL = const(0x97)
+_OP_GET_RX_BUFFER_STATUS = const(0x13)
 
 pin_sck = Pin(10, Pin.OUT)
 pin_mosi = Pin(11, Pin.OUT)
 pin_miso = Pin(12, Pin.IN)
-pin_cs = Pin(3, Pin.OUT, value=1)
+# CS and BUSY are also poked directly (viper SIO writes, PIO wait), so the
+# pin numbers live in one place
+_CS_PIN = const(3)
+_BUSY_PIN = const(2)
 
-pin_busy = Pin(2, Pin.IN)
+pin_cs = Pin(_CS_PIN, Pin.OUT, value=1)
+
+pin_busy = Pin(_BUSY_PIN, Pin.IN)
 
 pin_reset = Pin(15, Pin.OUT, value=1)
 
@@ -50,23 +83,196 @@ class IRQ_BITS:
     TIMEOUT = 1 << 9
 
 
-spi = SPI(1, sck=pin_sck, mosi=pin_mosi, miso=pin_miso)
+RF_FREQ = 902300000
+
+TX_BASE_ADDR = 0
+RX_BASE_ADDR = 128
+MAX_RX_PAYLOAD = 50
+
+# IRQs routed to DIO1 for both tx and rx
+DIO_IRQ_MASK = (IRQ_BITS.TXDONE | IRQ_BITS.RXDONE | IRQ_BITS.HEADER_ERR |
+                IRQ_BITS.TIMEOUT)
+
+
+# SX1262 is rated to 16 MHz SCK, 10 MHz leaves margin on the Waveshare board
+SPI_BAUDRATE = 10_000_000
+
+# Drive the SX1262 from a PIO state machine instead of the SPI1 peripheral.
+# The PIO program also waits for BUSY and frames CS, so no python runs
+# between commands.  Not yet checked on the bench, hence off by default.
+USE_PIO_SPI = False
+
+
+@rp2.asm_pio(out_shiftdir=rp2.PIO.SHIFT_LEFT, in_shiftdir=rp2.PIO.SHIFT_LEFT,
+             sideset_init=rp2.PIO.OUT_LOW, out_init=rp2.PIO.OUT_LOW,
+             set_init=rp2.PIO.OUT_HIGH)
+def _sx1262_spi():
+    # Mode 0 SPI, 4 PIO clocks per bit.  sideset: SCK, out: MOSI, in: MISO,
+    # set: CS
+    #
+    # Each frame is a header word (bit 31: read, bits 30:0: byte count - 1)
+    # followed by one word per byte, data in bits 31:24.  Read frames push
+    # one word per byte back, write frames push nothing.
+    wrap_target()
+    pull()                  .side(0)
+    out(y, 1)               .side(0)
+    out(x, 31)              .side(0)
+    # _BUSY_PIN is inlined by the compiler, asm_pio swaps out the module
+    # globals while it runs this function
+    wait(0, gpio, _BUSY_PIN) .side(0)
+    set(pins, 0)            .side(0)
+    jmp(not_y, "wbyte")     .side(0)
+    label("rbyte")
+    pull()                  .side(0)
+    set(y, 7)               .side(0)
+    label("rbit")
+    out(pins, 1)            .side(0) [1]
+    in_(pins, 1)            .side(1)
+    jmp(y_dec, "rbit")      .side(1)
+    push()                  .side(0)
+    jmp(x_dec, "rbyte")     .side(0)
+    jmp("end")              .side(0)
+    label("wbyte")
+    pull()                  .side(0)
+    set(y, 7)               .side(0)
+    label("wbit")
+    out(pins, 1)            .side(0) [1]
+    nop()                   .side(1)
+    jmp(y_dec, "wbit")      .side(1)
+    jmp(x_dec, "wbyte")     .side(0)
+    label("end")
+    set(pins, 1)            .side(0) [15]
+    nop()                   .side(0) [15]  # give BUSY time to rise
+    wrap()
+
+
+class PIOSPI:
+    """
+    write/write_readinto stand-in for machine.SPI that also handles CS and
+    BUSY.  write returns once the frame is queued, the state machine waits
+    for BUSY before starting the next one.
+    """
+
+    def __init__(self, sm_id, baudrate):
+        self._sm = rp2.StateMachine(sm_id, _sx1262_spi, freq=4 * baudrate,
+                                    sideset_base=pin_sck, out_base=pin_mosi,
+                                    in_base=pin_miso, set_base=pin_cs)
+        self._sm.active(1)
+
+    def write(self, buf):
+        self._sm.put(len(buf) - 1)
+        self._sm.put(buf, 24)
+
+    def write_readinto(self, buf, buf_in):
+        n = len(buf)
+        self._sm.put((1 << 31) | (n - 1))
+        # lock step so the rx FIFO never fills and stalls the state machine
+        for i in range(n):
+            self._sm.put(buf[i] << 24)
+            buf_in[i] = self._sm.get() & 0xff
+
+
+if USE_PIO_SPI:
+    spi = PIOSPI(0, SPI_BAUDRATE)
+else:
+    spi = SPI(1, baudrate=SPI_BAUDRATE, polarity=0, phase=0, firstbit=SPI.MSB,
+              sck=pin_sck, mosi=pin_mosi, miso=pin_miso)
+
+# bound once so the per-command path skips the attribute lookups
+_spi_write = spi.write
+_spi_rw = spi.write_readinto
+
+# Scratch buffers shared by every command, sized for the largest frame
+# (opcode + offset + status + 255 byte payload) so the SPI path never allocates
+_TX = bytearray(260)
+_RX = bytearray(260)
+_NOP = bytes(260)
+_tx_mv = memoryview(_TX)
+_rx_mv = memoryview(_RX)
+_nop_mv = memoryview(_NOP)
+
+
+# RP2040 SIO GPIO_OUT_SET / GPIO_OUT_CLR, written directly to toggle CS in a
+# single store instead of a Pin.value() call
+_SIO_GPIO_OUT_SET = const(0xd0000014)
+_SIO_GPIO_OUT_CLR = const(0xd0000018)
+_CS_MASK = const(1 << _CS_PIN)
+
+
+@micropython.viper
+def _cs_low():
+    ptr32(_SIO_GPIO_OUT_CLR)[0] = _CS_MASK
+
+
+@micropython.viper
+def _cs_high():
+    ptr32(_SIO_GPIO_OUT_SET)[0] = _CS_MASK
+
+
+if USE_PIO_SPI:
+    @micropython.native
+    def _xfer(buf, buf_in=None):
+        # BUSY and CS are handled by the state machine
+        if buf_in is None:
+            _spi_write(buf)
+        else:
+            _spi_rw(buf, buf_in)
+else:
+    @micropython.native
+    def _xfer(buf, buf_in=None):
+        wait_not_busy()
+        _cs_low()
+        if buf_in is None:
+            _spi_write(buf)
+        else:
+            _spi_rw(buf, buf_in)
+        _cs_high()
+
+
+@micropython.native
+def _cmd(op, tx=b'', rx=0):
+    """
+    Send opcode + tx bytes followed by rx NOPs in a single CS frame.
+    For reads returns a view of the whole frame as clocked back in, only
+    valid until the next command.
+    """
+    n = 1 + len(tx)
+    _TX[0] = op
+    _tx_mv[1:n] = tx
+    if rx:
+        _tx_mv[n:n + rx] = _nop_mv[:rx]
+        n += rx
+        _xfer(_tx_mv[:n], _rx_mv[:n])
+        return _rx_mv[:n]
+    _xfer(_tx_mv[:n])
+
 
 def op_code(code, total_bytes):
-    buff = bytearray(total_bytes)
-    buff[0] = code
-    buff_in = bytearray(total_bytes)
-    
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
-    
-    pin_cs.value(1)
-    return buff_in
+    return bytes(_cmd(code, rx=total_bytes - 1))
 
 
-def wait_not_busy():
-    while pin_busy.value() == 1:
-        time.sleep(.1)
+_busy_flag = [False]
+
+
+def _busy_irq(pin):
+    _busy_flag[0] = True
+
+
+@micropython.native
+def wait_not_busy(spin_us=50):
+    """
+    BUSY normally drops a few us after a command, so spin for a short while
+    before idling until the falling edge IRQ (attached in init) wakes us.
+    """
+    if pin_busy.value() == 0:
+        return
+    start = time.ticks_us()
+    while time.ticks_diff(time.ticks_us(), start) < spin_us:
+        if pin_busy.value() == 0:
+            return
+    _busy_flag[0] = False
+    while pin_busy.value() == 1 and not _busy_flag[0]:
+        machine.idle()
 
 
 def reset():
@@ -109,67 +315,66 @@ def get_status():
     0x5: failure to execute command
     0x6: command tx done (xmision terminated)
     """
-    wait_not_busy()
-    buff = bytearray(2)
-    buff[0] = 0xc0  # getStatus
-    buff_in = bytearray(2)
-    
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
-    
-    pin_cs.value(1)
-    return (buff_in[1], ((buff_in[1] & 0x70) >> 4), ((buff_in[1] & 0xe) >> 1),
-            status_modes.get((buff_in[1] & 0x70) >> 4),
-            cmd_status.get((buff_in[1] & 0xe) >> 1)
+    status = _cmd(_OP_GET_STATUS, rx=1)[1]
+    return (status, ((status & 0x70) >> 4), ((status & 0xe) >> 1),
+            status_modes.get((status & 0x70) >> 4),
+            cmd_status.get((status & 0xe) >> 1)
             )
 
 
+_CMD_SET_LORA = bytes((_OP_SET_PACKET_TYPE, 0x01))
+
+
 def set_lora():
-    wait_not_busy()
-    buff = bytearray(2)
-    buff[0] = 0x8a
-    buff[1] = 0x01
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_LORA)
 
 
 def write_buffer(offset, data):
+    """
+    data is clocked out straight after the header in the same CS frame
+    rather than copied in behind it
+    """
+    _TX[0] = _OP_WRITE_BUFFER
+    _TX[1] = offset
+    if USE_PIO_SPI:
+        # each PIO write is its own CS frame, header and data have to go
+        # out together
+        n = 2 + len(data)
+        _tx_mv[2:n] = data
+        _xfer(_tx_mv[:n])
+        return
     wait_not_busy()
-    buff = bytearray(2 + len(data))
-    buff[0] = 0x0e
-    buff[1] = offset
-    buff[2:] = data
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _cs_low()
+    _spi_write(_tx_mv[:2])
+    _spi_write(data)
+    _cs_high()
 
 
 def read_buffer(offset, num):
     """
     First byte is status, then data"""
-    wait_not_busy()
-    buff = bytearray(3 + num)
-    buff_in = bytearray(3 + num)
-    buff[0] = 0x1e
-    buff[1] = offset
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
-    pin_cs.value(1)
-    return buff_in[3:]  # throwing away status
+    n = 3 + num
+    _TX[0] = _OP_READ_BUFFER
+    _TX[1] = offset
+    _tx_mv[2:n] = _nop_mv[:1 + num]
+    _xfer(_tx_mv[:n], _rx_mv[:n])
+    return bytes(_rx_mv[3:n])  # throwing away status
+
+_CMD_SET_BUFFER_BASE_ADDR = bytes((_OP_SET_BUFFER_BASE_ADDR,
+                                   TX_BASE_ADDR,
+                                   RX_BASE_ADDR,
+                                   ))
+
 
 def set_buffer_base_addr():
     """
     pg. 93
     """
-    wait_not_busy()
-    buff = bytearray(3)
-    buff[0] = 0x8f
-    buff[1] = 0  # tx 
-    buff[2] = 128  # rx
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_BUFFER_BASE_ADDR)
+
+
+# max power?  +22 dBm
+_CMD_SET_PA_CONFIG = bytes((_OP_SET_PA_CONFIG, 0x04, 0x07, 0x00, 0x01))
 
 
 def set_pa_config():
@@ -177,34 +382,34 @@ def set_pa_config():
     pg. 76
     Think I have the SX1262
     """
-    wait_not_busy()
-    buff = bytearray(5)
-    buff[0] = 0x95
-    # max power?  +22 dBm
-    buff[1] = 0x04
-    buff[2] = 0x07
-    buff[3] = 0x0
-    buff[4] = 0x1
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_PA_CONFIG)
+
+
+_CMD_SET_TX_PARAMS = bytes((_OP_SET_TX_PARAMS,
+                            0x16,  # 22 dBm
+                            0x06,  # 1700 us
+                            ))
 
 
 def set_tx_params():
     """
     pg. 84
     """
-    wait_not_busy()
-    buff = bytearray(3)
-    buff[0] = 0x8e
-    buff[1] = 0x16  # 22 dBm
-    buff[2] = 0x06 # 1700 us
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_TX_PARAMS)
 
 
 
+# only the payload size (byte 4) changes between calls
+_CMD_SET_PACKET_PARAMS = bytearray((_OP_SET_PACKET_PARAMS,
+                                    0x0,
+                                    0xe,  # no idea... preamble length
+                                    0x0,  # 0 => variable length packet
+                                    0,  # payload size, in receive mode it is the max we can receive
+                                    0x1,  # crc on
+                                    0x0,  # Standard Iq
+                                    0x0, 0x0, 0x0))
+
+
 def set_packet_params(payload_size):
     """
     pg. 88
@@ -219,37 +424,29 @@ def set_packet_params(payload_size):
     
     pg 87 describes parameters (modulation parameters? not packet?)
     """
-    wait_not_busy()
-    buff = bytearray(10)
-    buff[0] = 0x8c
-    # buff[1] = 
-    buff[2] = 0xe  # no idea... preamble length
-    buff[3] = 0x0  # 0 => variable length packet
-    buff[4] = payload_size  # in receive mode it is the max we can receive
-    buff[5] = 0x1  # crc on
-    buff[6] = 0x0  # Standard Iq
-    
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _CMD_SET_PACKET_PARAMS[4] = payload_size
+    _xfer(_CMD_SET_PACKET_PARAMS)
+
+
+_CMD_SET_MODULATION_PARAMS = bytes((
+    _OP_SET_MODULATION_PARAMS,
+    # 0x1, # SF5  pg 87
+    0x0c,  # SF7  pg 87 longest time on error
+    # 0x0,  # BW 7.81 kHz  (lowest)
+    0x4,  # 125 kHz
+    0x04,  # CR 1-4 higher has more error immunity
+    1,  # low data rate optimize if  0x01
+    0x0, 0x0, 0x0, 0x0))
 
 
 def set_modulation_params():
     """
     pg. 87
     """
-    wait_not_busy()
-    buff = bytearray(9)
-    buff[0] = 0x8b
-    # buff[1] = 0x1 # SF5  pg 87
-    buff[1] = 0x0c # SF7  pg 87 longest time on error
-    # buff[2] = 0x0  # BW 7.81 kHz  (lowest)
-    buff[2] = 0x4  # 125 kHz
-    buff[3] = 0x04  # CR 1-4 higher has more error immunity
-    buff[4] = 1 # low data rate optimize if  0x01
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_MODULATION_PARAMS)
+
+
+_CMD_SET_TX = bytes((_OP_SET_TX, 0, 0, 0))
 
 
 def set_tx(timeout=0):
@@ -257,13 +454,8 @@ def set_tx(timeout=0):
     timeout = 15.625 us * timeout
     pg 68
     """
-    wait_not_busy()
-    buff = bytearray(4)
-    buff[0] = 0x83
     # Timeout not implemented
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_TX)
 
 
 def set_standby(mode):
@@ -272,13 +464,9 @@ def set_standby(mode):
     1: STBY_XOSC
     pg. 68
     """
-    wait_not_busy()
-    buff = bytearray(2)
-    buff[0] = 0x80
-    buff[1] = mode
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _TX[0] = _OP_SET_STANDBY
+    _TX[1] = mode
+    _xfer(_tx_mv[:2])
 
 
 def get_errors():
@@ -286,27 +474,17 @@ def get_errors():
     pg. 98
     Status codes on page: 95
     """
-    wait_not_busy()
-    buff = bytearray(4)
-    buff[0] = 0x17
-    buff_in = bytearray(4)
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
-    pin_cs.value(1)
-    
-    return buff_in[1:]
+    return bytes(_cmd(_OP_GET_DEVICE_ERRORS, rx=3)[1:])
+
+
+_CMD_CLEAR_ERRORS = bytes((_OP_CLEAR_DEVICE_ERRORS, 0, 0))
 
 
 def clear_errors():
     """
     pg. 98
     """
-    wait_not_busy()
-    buff = bytearray(3)
-    buff[0] = 0x07
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_CLEAR_ERRORS)
 
 
 def set_reg_mode(mode):
@@ -316,37 +494,27 @@ def set_reg_mode(mode):
     0: LDO only
     1: DC + DC and LDO
     """
-    wait_not_busy()
-    buff = bytearray(2)
-    buff[0] = 0x96
-    buff[1] = mode
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _TX[0] = _OP_SET_REGULATOR_MODE
+    _TX[1] = mode
+    _xfer(_tx_mv[:2])
+
 
+_rf_freq_cmds = {}
 
-def set_rf_freq(freq):
+
+def set_rf_freq(freq=RF_FREQ):
     """
     try 902300000
+
+    The command frame is computed once per frequency and cached.
     """
-    wait_not_busy()
-    rfFreq = int(freq * 33554432 / 32000000)
-    # buf = (
-    #         (rfFreq >> 24) & 0xFF,
-    #         (rfFreq >> 16) & 0xFF,
-    #         (rfFreq >> 8) & 0xFF,
-    #         rfFreq & 0xFF
-    #     )
-    #     self._writeBytes(0x86, buf, 4)
-    buf = bytearray(5)
-    buf[0] = 0x86
-    buf[1] = (rfFreq >> 24) & 0xff
-    buf[2] = (rfFreq >> 16) & 0xff
-    buf[3] = (rfFreq >> 8) & 0xff
-    buf[4] = rfFreq & 0xff
-    pin_cs.value(0)
-    spi.write(buf)
-    pin_cs.value(1)
+    cmd = _rf_freq_cmds.get(freq)
+    if cmd is None:
+        # integer math, single precision floats lose the low bits of rfFreq
+        rfFreq = freq * 33554432 // 32000000
+        cmd = struct.pack('>BI', _OP_SET_RF_FREQUENCY, rfFreq)
+        _rf_freq_cmds[freq] = cmd
+    _xfer(cmd)
 
 
 def set_rx(timeout_sec=0):
@@ -354,45 +522,52 @@ def set_rx(timeout_sec=0):
     pg. 69
     0xFFFFFF for continuous mode
     """
-    wait_not_busy()
     timeout_int = int(timeout_sec / 15.625e-6)
-    buf = bytearray(4)
-    buf[0] = 0x82
-    buf[1] = (timeout_int >> 16) & 0xff
-    buf[2] = (timeout_int >> 8) & 0xff
-    buf[3] = timeout_int & 0xff
-    pin_cs.value(0)
-    spi.write(buf)
-    pin_cs.value(1)
+    # 24 bit timeout: pack 32 bits and let the opcode overwrite the top byte
+    struct.pack_into('>I', _TX, 0, timeout_int & 0xffffff)
+    _TX[0] = _OP_SET_RX
+    _xfer(_tx_mv[:4])
 
 
 def get_irq_status():
     """
     pg. 80
     """
-    wait_not_busy()
-    buf = bytearray(4)
-    buf_in = bytearray(4)
-    buf[0] = 0x12
-    
-    pin_cs.value(0)
-    spi.write_readinto(buf, buf_in)
-    pin_cs.value(1)
-    return buf_in[1:]
+    return bytes(_cmd(_OP_GET_IRQ_STATUS, rx=3)[1:])
+
+
+_clear_irq_cmds = {}
 
 
 def clear_irq_status(mask):
     """
     pg. 81
+
+    Frames are cached per mask like set_rf_freq, the handlers only ever
+    clear a couple of different masks.
     """
-    wait_not_busy()
-    buf = bytearray(3)
-    buf[0] = 0x02
-    buf[1] = (mask >> 8) & 0xff
-    buf[2] = mask & 0xff
-    pin_cs.value(0)
-    spi.write(buf)
-    pin_cs.value(1)
+    _xfer(_clear_irq_cmd(mask))
+
+
+def _clear_irq_cmd(mask):
+    cmd = _clear_irq_cmds.get(mask)
+    if cmd is None:
+        cmd = struct.pack('>BH', _OP_CLEAR_IRQ_STATUS, mask)
+        _clear_irq_cmds[mask] = cmd
+    return cmd
+
+
+def get_and_clear_irq_status(mask):
+    """
+    GetIrqStatus immediately followed by ClearIrqStatus(mask), sharing the
+    scratch buffer.  Still two CS frames, the chip needs one per command.
+    Returns the same 3 bytes as get_irq_status.
+    """
+    _TX[0] = _OP_GET_IRQ_STATUS
+    _tx_mv[1:4] = _nop_mv[:3]
+    _xfer(_tx_mv[:4], _rx_mv[:4])
+    _xfer(_clear_irq_cmd(mask))
+    return bytes(_rx_mv[1:4])
 
 
 def read_reg(reg):
@@ -401,49 +576,40 @@ def read_reg(reg):
     pass
 
 
+_dio_irq_cmds = {}
+
+
 def set_dio_irq_params(mask):
     """
     pg 79
     """
-    wait_not_busy()
-    buf = bytearray(9)
-    buf[0] = 0x08
-    buf[1] = (mask >> 8) & 0xff
-    buf[2] = mask & 0xff
-    # set irq to DIO1
-    buf[3] = (mask >> 8) & 0xff
-    buf[4] = mask & 0xff
-    
-    pin_cs.value(0)
-    spi.write(buf)
-    pin_cs.value(1)
+    cmd = _dio_irq_cmds.get(mask)
+    if cmd is None:
+        # irq mask, then the same mask routed to DIO1, nothing on DIO2/3
+        cmd = struct.pack('>BHHHH', _OP_SET_DIO_IRQ_PARAMS, mask, mask, 0, 0)
+        _dio_irq_cmds[mask] = cmd
+    _xfer(cmd)
+
+
+_CMD_SET_DIO2_RF_SWITCH = bytes((_OP_SET_DIO2_AS_RF_SWITCH_CTRL,
+                                 0x01,  # DIO2 as RF switch
+                                 ))
 
 
 def SetDIO2AsRfSwitchCtrl():
-    wait_not_busy()
-    buf = bytearray(2)
-    buf[0] = 0x9d
-    buf[1] = 0x1  # DIO2 as RF switch
-    pin_cs.value(0)
-    spi.write(buf)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_DIO2_RF_SWITCH)
 
 
 def SetDIO3AsTCXOCtrl(delay=5 << 6):
     """
     pg 81
     """
-    wait_not_busy()
-    buf = bytearray(5)
-    buf[0] = 0x97
-    # buf[1] = 0x07  # 3.3 V? not sur what this should be
-    buf[1] = 0x01  # 1.7 V? not sur what this should be
-    buf[2] = (delay >> 16) & 0xff
-    buf[3] = (delay >> 8) & 0xff 
-    buf[4] = delay & 0xff
-    pin_cs.value(0)
-    spi.write(buf)
-    pin_cs.value(1)
+    # 24 bit delay: pack 32 bits and let the voltage overwrite the top byte
+    struct.pack_into('>I', _TX, 1, delay & 0xffffff)
+    _TX[0] = _OP_SET_DIO3_AS_TCXO_CTRL
+    # _TX[1] = 0x07  # 3.3 V? not sur what this should be
+    _TX[1] = 0x01  # 1.7 V? not sur what this should be
+    _xfer(_tx_mv[:5])
 
 
 def GetRxBufferStatus():
@@ -451,14 +617,22 @@ def GetRxBufferStatus():
     pg 96
     returns 3 bytes: Status, PayloadLengthRx, RxStartBufferPointer
     """
-    wait_not_busy()
-    buf = bytearray(4)
-    buf[0] = 0x13
-    buf_in = bytearray(4)
-    pin_cs.value(0)
-    spi.write_readinto(buf, buf_in)
-    pin_cs.value(1)
-    return buf_in[1:]
+    return bytes(_cmd(_OP_GET_RX_BUFFER_STATUS, rx=3)[1:])
+
+
+def read_rx_payload():
+    """
+    Fetch a received packet after RxDone.
+
+    The payload length only comes from GetRxBufferStatus, and the chip wants
+    each command in its own CS frame, so this is still two transactions.  The
+    start pointer moves from packet to packet in continuous RX, so it is
+    taken from the same status reply rather than assumed to be RX_BASE_ADDR.
+    """
+    # Status, PayloadLengthRx, RxStartBufferPointer
+    st = _cmd(_OP_GET_RX_BUFFER_STATUS, rx=3)
+    length, start = st[2], st[3]
+    return read_buffer(start, length)
 
 
 def tx(payload: bytes):
@@ -476,27 +650,32 @@ def tx(payload: bytes):
     # # 5. set_tx_power
     # set_tx_params()  #***
 
-    # 6. set_buffer_base_addr
-    set_buffer_base_addr()
+    # 6. set_buffer_base_addr, 8. modulation params and 10. DIO/IRQ config
+    # are the same for every packet and done once in init()
 
     # 7. write buffer
-    write_buffer(0, payload)
-
-    # 8. set modulation params
-    set_modulation_params()
+    write_buffer(TX_BASE_ADDR, payload)
 
     # 9. set packet params
     set_packet_params(len(payload))
 
-    # 10. config DIO and IRQ:  TxDone IRQ and map this IRQ to a DIO (DIO1, DIO2 or DIO3)
-    # set_dio_irq_params(0x1)
-    set_dio_irq_params(0x203)
     # 11. sync word
     # 12. transmit
     set_tx()
 
 
+_initialized = False
+
+
 def init():
+    """
+    Safe to call more than once, only the first call resets and configures
+    the chip.
+    """
+    global _initialized
+    if _initialized:
+        return
+    pin_busy.irq(_busy_irq, trigger=Pin.IRQ_FALLING, hard=True)
     reset()
     time.sleep(.5)
 
@@ -504,85 +683,130 @@ def init():
     SetDIO3AsTCXOCtrl()
     set_lora()
     # 3. set frequency
-    set_rf_freq(902300000)
+    set_rf_freq(RF_FREQ)
     set_pa_config()
     set_tx_params()
 
+    # static tx/rx config, see tx() and rx()
+    set_buffer_base_addr()
+    set_modulation_params()
+    set_dio_irq_params(DIO_IRQ_MASK)
+
     clear_errors()
+    _initialized = True
 
 
 def rx(timeout=30):
     # 1. set stby
-    # 2. set lora
-    #clear_errors()
-    # SetDIO2AsRfSwitchCtrl()
-    # SetDIO3AsTCXOCtrl()
-    # set_lora()
-    # # 3. set frequency
-    # set_rf_freq(902300000)
-    # 4. set base addr
-    set_buffer_base_addr()
-    # 5. modulation params
-    set_modulation_params()
-    # 6. frame format
-    set_packet_params(50)  # max rx length
-    # 7. IRQs: to select the IRQ RxDone and map this IRQ to a DIO (DIO1 or DIO2 or DIO3), set IRQ Timeout as well
-    # set_dio_irq_params(0x203)
-    set_dio_irq_params(IRQ_BITS.RXDONE | IRQ_BITS.TIMEOUT | IRQ_BITS.HEADER_ERR)
+    # 2. set lora and 3. set frequency are done once in init()
+    # 4. base addr, 5. modulation params and 7. IRQs are done once in init()
+    # 6. frame format (tx() changes the payload length so set every time)
+    set_packet_params(MAX_RX_PAYLOAD)  # max rx length
 
     # 8. sync word
     # 9. setrx
     set_rx(timeout)
 
 
-def led_blink(num, delay=0.25):
+async def _blink(num, delay):
     for _ in range(num):
         pin_led.value(1)
-        time.sleep(delay)
+        await asyncio.sleep(delay)
         pin_led.value(0)
-        time.sleep(delay)
-    
+        await asyncio.sleep(delay)
+
+
+def led_blink(num, delay=0.25):
+    """
+    Returns immediately, the blinking runs as a task on the event loop
+    """
+    asyncio.create_task(_blink(num, delay))
+
 
 def status_blink():
     _, mode, cmd, _, _ = get_status()
     led_blink(mode, .25)
 
 
-tim = Timer(-1)
+async def _periodic(func, period):
+    while True:
+        await asyncio.sleep(period)
+        func()
+
 
-def main():
+async def main():
     
-    # await asyncio.sleep_ms(2000)
-    time.sleep(2)
+    init()
+    await asyncio.sleep_ms(2000)
     clear_errors()
     clear_irq_status(1)
     
     # led_blink(5)
     status_blink()
     
-    tim.init(mode=Timer.PERIODIC, period=5000, callback=lambda x:status_blink())
+    asyncio.create_task(_periodic(status_blink, 5))
     
     # tx(b'strobe')
     rx()
+
+    # the dispatcher started by set_dio_handler keeps the loop alive
+    await _dio_dispatcher[0]
         
 
 payload = b'empty'
 
+_dio_handler = [None]
+_dio_dispatcher = [None]
+_dio_flag = asyncio.ThreadSafeFlag()
+
+
+def _dio_isr(pin):
+    # hard IRQ: nothing that allocates or talks SPI, just wake _dio_task
+    # (edges coalesce, the handler reads the irq status)
+    _dio_flag.set()
+
+
+async def _dio_task():
+    while True:
+        await _dio_flag.wait()
+        try:
+            _dio_handler[0](pin_dio1)
+        except Exception as e:
+            # keep dispatching (and the status task alive) after a bad packet
+            print('dio handler error:', e)
+
+
+def set_dio_handler(handler):
+    """
+    Run handler(pin) from the event loop on each DIO1 rising edge
+
+    The dispatcher task is created on the first call, so edges are handled
+    under any asyncio.run(), not just main().  With no loop running (e.g.
+    tx()/rx() from the REPL) edges coalesce and are handled once one runs.
+    """
+    _dio_handler[0] = handler
+    if _dio_dispatcher[0] is None:
+        _dio_dispatcher[0] = asyncio.create_task(_dio_task())
+    pin_dio1.irq(_dio_isr, trigger=Pin.IRQ_RISING, hard=True)
+
+
+async def _tx_after(payload, delay):
+    await asyncio.sleep(delay)
+    tx(payload)
+
+
 def dio_echo_irq(pin):
     
-    tmp = get_irq_status()
+    tmp = get_and_clear_irq_status(DIO_IRQ_MASK)
     print('irq status:', tmp)
-    clear_irq_status(0x203)
     # 
     if tmp[2] & 0x2 == 0x2:
         # rxdone
         led_blink(1)
-        buf = GetRxBufferStatus() # Status, PayloadLengthRx, RxStartBufferPointer
-        payload = read_buffer(buf[2], buf[1])
+        payload = read_rx_payload()
         print('echo rcv:', payload)
         set_standby(0)
-        time.sleep(2)
-        tx(payload)
+        asyncio.create_task(_tx_after(payload, 2))
     elif tmp[2] & 0x1 == 0x1:
         # txdone
         # led_blink(2)
@@ -600,15 +824,14 @@ def dio_echo_irq(pin):
 
 def dio_rx_irq(pin):
     
-    tmp = get_irq_status()
+    tmp = get_and_clear_irq_status(DIO_IRQ_MASK)
     print(tmp)
     
     if tmp[2] & 0x2 == 0x2:
         # rxdone
         led_blink(1)
         
-        buf = GetRxBufferStatus() # Status, PayloadLengthRx, RxStartBufferPointer
-        payload = read_buffer(buf[2], buf[1])
+        payload = read_rx_payload()
         print("rx irq rcvd", payload)
         set_standby(0)
         # tx(payload)
@@ -626,14 +849,12 @@ def dio_rx_irq(pin):
         # timeout
         rx()
     
-    clear_irq_status(0x203)
-    
 
 
 def dio_strobe_irq(pin):
     
 
-    tmp = get_irq_status()
+    tmp = get_and_clear_irq_status(DIO_IRQ_MASK)
     print(tmp)
 
     if tmp[2] & 0x2 == 0x2:
@@ -648,16 +869,12 @@ def dio_strobe_irq(pin):
     elif tmp[2] & 0x1 == 0x1:
         # txdone
         led_blink(2)
-        time.sleep(2)
-
-        tx(b'strobe')
+        asyncio.create_task(_tx_after(b'strobe', 2))
         # back to rx
         
-    
-    clear_irq_status(0x3)
 
-pin_dio1.irq(dio_echo_irq, trigger=Pin.IRQ_RISING)
-# pin_dio1.irq(dio_rx_irq, trigger=Pin.IRQ_RISING)
+set_dio_handler(dio_echo_irq)
+# set_dio_handler(dio_rx_irq)
 
 
 # Lora model description pg. 37
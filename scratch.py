@@ -18,91 +18,173 @@ Raspberry Pi doc of GPIOS:
 https://www.raspberrypi.com/documentation/microcontrollers/raspberry-pi-pico.html
 """
 
-import machine
-from machine import Pin, SPI, SoftSPI
+import micropython
+from micropython import const
+import struct
+from machine import Pin, SPI
 import time
 
+# SX1262 opcodes
+_OP_GET_STATUS = const(0xc0)
+_OP_SET_PACKET_TYPE = const(0x8a)
+_OP_WRITE_BUFFER = const(0x0e)
+_OP_READ_BUFFER = const(0x1e)
+_OP_SET_BUFFER_BASE_ADDR = const(0x8f)
+_OP_SET_PA_CONFIG = const(0x95)
+_OP_SET_TX_PARAMS = const(0x8e)
+_OP_SET_PACKET_PARAMS = const(0x8c)
+_OP_SET_MODULATION_PARAMS = const(0x8b)
+_OP_SET_TX = const(0x83)
+_OP_SET_STANDBY = const(0x80)
+_OP_GET_DEVICE_ERRORS = const(0x17)
+_OP_CLEAR_DEVICE_ERRORS = const(0x07)
+_OP_SET_REGULATOR_MODE = const(0x96)
+_OP_SET_RF_FREQUENCY = const(0x86)
+
 pin_sck = Pin(10, Pin.OUT)
 pin_mosi = Pin(11, Pin.OUT)
 pin_miso = Pin(12, Pin.IN)
 pin_cs = Pin(3, Pin.OUT, value=1)
 
-pin_busy = Pin(2, Pin.IN)
+_BUSY_PIN = const(2)
+pin_busy = Pin(_BUSY_PIN, Pin.IN)
 
 pin_led = Pin(25, Pin.OUT)
 
 
-spi = SPI(1, sck=pin_sck, mosi=pin_mosi, miso=pin_miso)
-
-def op_code(code, total_bytes):
-    buff = bytearray(total_bytes)
-    buff[0] = code
-    buff_in = bytearray(total_bytes)
-    
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
+# same SCK as my_sx1262.SPI_BAUDRATE
+spi = SPI(1, baudrate=10_000_000, polarity=0, phase=0, bits=8,
+          firstbit=SPI.MSB, sck=pin_sck, mosi=pin_mosi, miso=pin_miso)
+
+# bound once so each transfer is a global load instead of attribute lookups
+_cs = pin_cs.value
+_spi_write = spi.write
+_spi_rw = spi.write_readinto
+
+# Command buffers allocated once and reused, one per frame length.  Every
+# helper rewrites all the bytes of the buffer it uses.
+_BUF2 = bytearray(2)
+_BUF5 = bytearray(5)
+# read_buffer / op_code: opcode + offset + status + 255 bytes
+_BUF_DATA = bytearray(260)
+_MV_DATA = memoryview(_BUF_DATA)
+# Every read clocks its reply into this one buffer, so returned views are
+# only good until the next read (fine, nothing here is re-entrant)
+_IN_SCRATCH = bytearray(260)
+_MV_IN = memoryview(_IN_SCRATCH)
+_MV_IN2 = _MV_IN[:2]
+_MV_IN4 = _MV_IN[:4]
+_ZEROS = memoryview(bytes(260))
+
+
+@micropython.viper
+def _wait_busy():
+    # spin on the RP2040 SIO GPIO_IN register until pin_busy is low
+    gpio_in = ptr32(0xd0000004)
+    while gpio_in[0] & (1 << _BUSY_PIN):
+        pass
+
+
+@micropython.native
+def _xfer(buf):
+    _wait_busy()
+    _cs(0)
+    _spi_write(buf)
+    _cs(1)
+
+
+@micropython.native
+def _xfer_rw(buf, buf_in):
+    _wait_busy()
+    _cs(0)
+    _spi_rw(buf, buf_in)
+    _cs(1)
+
+
+@micropython.native
+def op_code(code, total_bytes, read=False):
+    """
+    Only clocks the reply in (and returns it) if read is set
+    """
+    _MV_DATA[:total_bytes] = _ZEROS[:total_bytes]
+    _BUF_DATA[0] = code
     
-    pin_cs.value(1)
-    return buff_in
+    if not read:
+        _xfer(_MV_DATA[:total_bytes])
+        return
+    _xfer_rw(_MV_DATA[:total_bytes], _MV_IN[:total_bytes])
+    return _MV_IN[:total_bytes]
+
 
+_CMD_GET_STATUS = bytes((_OP_GET_STATUS, 0))
 
+
+@micropython.native
 def get_status():
     """
     Status codes on page: 95
+
+    Returns ints (status, chip mode, command status), hex() them for display
     """
-    buff = bytearray(2)
-    buff[0] = 0xc0  # getStatus
-    buff_in = bytearray(2)
-    
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
-    
-    pin_cs.value(1)
-    return (hex(buff_in[1]), hex((buff_in[1] & 0x70) >> 4), hex((buff_in[1] & 0xe) >> 1))
+    _xfer_rw(_CMD_GET_STATUS, _MV_IN2)
+    status = _IN_SCRATCH[1]
+    return status, (status & 0x70) >> 4, (status & 0x0e) >> 1
+
+
+_CMD_SET_LORA = bytes((_OP_SET_PACKET_TYPE, 0x01))
 
 
 def set_lora():
-    buff = bytearray(2)
-    buff[0] = 0x8a
-    buff[1] = 0x01
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_LORA)
+
+
+_CMD_WRITE_BUFFER_HDR = bytearray((_OP_WRITE_BUFFER, 0))
 
 
 def write_buffer(offset, data):
-    buff = bytearray(2 + len(data))
-    buff[0] = 0x0e
-    buff[1] = offset
-    buff[2:] = data
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    """
+    data can be anything with the buffer protocol, it's sent as a second
+    write inside the header's CS frame so it never gets copied
+    """
+    _CMD_WRITE_BUFFER_HDR[1] = offset
+    _wait_busy()
+    _cs(0)
+    _spi_write(_CMD_WRITE_BUFFER_HDR)
+    _spi_write(data)
+    _cs(1)
 
 
-def read_buffer(offset, num):
+@micropython.native
+def read_buffer(offset, num, out=None):
     """
-    First byte is status, then data"""
-    buff = bytearray(3 + num)
-    buff_in = bytearray(3 + num)
-    buff[0] = 0x1e
-    buff[1] = offset
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
-    pin_cs.value(1)
-    return buff_in[3:]  # throwing away status
+    First byte is status, then data
+
+    Returns a view into a shared buffer that is only valid until the next
+    read, pass out to have the data copied into it instead."""
+    n = 3 + num
+    _BUF_DATA[0] = _OP_READ_BUFFER
+    _BUF_DATA[1] = offset
+    _MV_DATA[2:n] = _ZEROS[:n - 2]
+    _xfer_rw(_MV_DATA[:n], _MV_IN[:n])
+    if out is not None:
+        out[:num] = _MV_IN[3:n]
+        return out
+    return _MV_IN[3:n]  # throwing away status
+
+_CMD_SET_BUFFER_BASE_ADDR = bytes((_OP_SET_BUFFER_BASE_ADDR,
+                                   0,  # tx
+                                   128,  # rx
+                                   ))
 
 def set_buffer_base_addr():
     """
     pg. 93
     """
-    buff = bytearray(3)
-    buff[0] = 0x8f
-    buff[0] = 0  # tx 
-    buff[0] = 0  # rx
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_BUFFER_BASE_ADDR)
+
+
+# max power?  +22 dBm
+_CMD_SET_PA_CONFIG = bytes((_OP_SET_PA_CONFIG, 0x04, 0x07, 0x00, 0x01))
 
 
 def set_pa_config():
@@ -110,30 +192,32 @@ def set_pa_config():
     pg. 76
     Think I have the SX1262
     """
-    buff = bytearray(5)
-    buff[0] = 0x95
-    # max power?  +22 dBm
-    buff[1] = 0x04
-    buff[2] = 0x07
-    buff[3] = 0x0
-    buff[4] = 0x1
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_PA_CONFIG)
+
+
+_CMD_SET_TX_PARAMS = bytes((_OP_SET_TX_PARAMS,
+                            0x16,  # 22 dBm
+                            0x06,  # 1700 us
+                            ))
 
 
 def set_tx_params():
     """
     pg. 84
     """
-    buff = bytearray(3)
-    buff[0] = 0x8e
-    buff[1] = 0x16  # 22 dBm
-    buff[2] = 0x06 # 1700 us
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_TX_PARAMS)
+
+
 
+# template, set_packet_params and configure_tx patch in the payload size
+_CMD_SET_PACKET_PARAMS = bytearray((_OP_SET_PACKET_PARAMS,
+                                    0,
+                                    0xe,  # no idea...
+                                    0x0,
+                                    0,  # payload size
+                                    0x1,
+                                    0x0,
+                                    0, 0, 0))
 
 
 def set_packet_params(payload_size):
@@ -150,32 +234,26 @@ def set_packet_params(payload_size):
     
     pg 87 describes parameters (modulation parameters? not packet?)
     """
-    buff = bytearray(10)
-    buff[0] = 0x8c
-    buff[2] = 0xe  # no idea...
-    buff[3] = 0x0
-    buff[4] = payload_size
-    buff[5] = 0x1
-    buff[6] = 0x0
-    
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _CMD_SET_PACKET_PARAMS[4] = payload_size
+    _xfer(_CMD_SET_PACKET_PARAMS)
+
+
+_CMD_SET_MODULATION_PARAMS = bytes((_OP_SET_MODULATION_PARAMS,
+                                    0,  # SF
+                                    0x0,  # BW 7.81 kHz  (lowest)
+                                    0x01,  # CR
+                                    0,  # low data rate optimize if  0x01
+                                    0, 0, 0, 0, 0))
 
 
 def set_modulation_params():
     """
     pg. 87
     """
-    buff = bytearray(10)
-    buff[0] = 0x8b
-    buff[1] = 0 # SF
-    # buff[2] = 0x0  # BW 7.81 kHz  (lowest)
-    buff[3] = 0x01  # CR
-    # buff[4] = 0 # low data rate optimize if  0x01
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_MODULATION_PARAMS)
+
+
+_CMD_SET_TX = bytes((_OP_SET_TX, 0, 0, 0))
 
 
 def set_tx(timeout=0):
@@ -183,12 +261,8 @@ def set_tx(timeout=0):
     timeout = 15.625 us * timeout
     pg 68
     """
-    buff = bytearray(4)
-    buff[0] = 0x83
     # Timeout not implemented
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_SET_TX)
 
 
 def set_standby(mode):
@@ -197,12 +271,12 @@ def set_standby(mode):
     1: STBY_XOSC
     pg. 68
     """
-    buff = bytearray(2)
-    buff[0] = 0x80
-    buff[1] = mode
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _BUF2[0] = _OP_SET_STANDBY
+    _BUF2[1] = mode
+    _xfer(_BUF2)
+
+
+_CMD_GET_ERRORS = bytes((_OP_GET_DEVICE_ERRORS, 0, 0, 0))
 
 
 def get_errors():
@@ -210,25 +284,19 @@ def get_errors():
     pg. 98
     Status codes on page: 95
     """
-    buff = bytearray(4)
-    buff[0] = 0x17
-    buff_in = bytearray(4)
-    pin_cs.value(0)
-    spi.write_readinto(buff, buff_in)
-    pin_cs.value(1)
+    _xfer_rw(_CMD_GET_ERRORS, _MV_IN4)
     
-    return buff_in[1:]
+    return _MV_IN[1:4]
+
+
+_CMD_CLEAR_ERRORS = bytes((_OP_CLEAR_DEVICE_ERRORS, 0, 0))
 
 
 def clear_errors():
     """
     pg. 98
     """
-    buff = bytearray(3)
-    buff[0] = 0x07
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _xfer(_CMD_CLEAR_ERRORS)
 
 
 def set_reg_mode(mode):
@@ -238,62 +306,73 @@ def set_reg_mode(mode):
     0: LDO only
     1: DC + DC and LDO
     """
-    buff = bytearray(2)
-    buff[0] = 0x96
-    buff[1] = mode
-    pin_cs.value(0)
-    spi.write(buff)
-    pin_cs.value(1)
+    _BUF2[0] = _OP_SET_REGULATOR_MODE
+    _BUF2[1] = mode
+    _xfer(_BUF2)
+
+
+@micropython.viper
+def _pack_freq(buf: ptr8, f: int):
+    buf[0] = _OP_SET_RF_FREQUENCY
+    buf[1] = (f >> 24) & 0xff
+    buf[2] = (f >> 16) & 0xff
+    buf[3] = (f >> 8) & 0xff
+    buf[4] = f & 0xff
 
 
 def set_rf_freq(freq):
     """
     try 902300000
     """
-    rfFreq = int(freq * 33554432 / 32000000)
-    # buf = (
-    #         (rfFreq >> 24) & 0xFF,
-    #         (rfFreq >> 16) & 0xFF,
-    #         (rfFreq >> 8) & 0xFF,
-    #         rfFreq & 0xFF
-    #     )
-    #     self._writeBytes(0x86, buf, 4)
-    buf = bytearray(5)
-    buf[0] = 0x86
-    buf[1] = (rfFreq >> 24) & 0xff
-    buf[2] = (rfFreq >> 16) & 0xff
-    buf[3] = (rfFreq >> 8) & 0xff
-    buf[4] = rfFreq & 0xff
-    pin_cs.value(0)
-    spi.write(buf)
-    pin_cs.value(1)
+    # rfFreq = freq * 2**25 / 32 MHz xtal, kept in ints
+    rfFreq = freq * 33554432 // 32000000
+    _pack_freq(_BUF5, rfFreq)
+    _xfer(_BUF5)
 
 
 
-def tx():
-    # Basic transmit description page 99
-    # 2. set_lora
-    set_lora()
-    # 3. set_rf_freq
-    set_rf_freq(902300000)
+# set_rf_freq(902300000)
+_CMD_SET_RF_FREQ = struct.pack('>BI', _OP_SET_RF_FREQUENCY,
+                               902300000 * 33554432 // 32000000)
+
+# Everything tx() sends that doesn't depend on the payload, built once.  The
+# SX1262 takes one opcode per CS frame so each command is its own transfer.
+_CONFIG_CMDS = (
+    _CMD_SET_LORA,
+    _CMD_SET_RF_FREQ,
+    _CMD_SET_PA_CONFIG,
+    _CMD_SET_TX_PARAMS,
+    _CMD_SET_BUFFER_BASE_ADDR,
+)
 
-    # 4. PA config
-    set_pa_config()
 
-    # 5. set_tx_power
-    set_tx_params()
+def configure():
+    for cmd in _CONFIG_CMDS:
+        _xfer(cmd)
 
+
+def configure_tx(payload_size):
+    """
+    Modulation then packet params, back to back.  These can't share a CS
+    frame (the chip executes one opcode per frame), so it's two transfers
+    from prebuilt buffers.
+    """
+    _CMD_SET_PACKET_PARAMS[4] = payload_size
+    _xfer(_CMD_SET_MODULATION_PARAMS)
+    _xfer(_CMD_SET_PACKET_PARAMS)
+
+
+def tx():
+    # Basic transmit description page 99
+    # 2. set_lora, 3. set_rf_freq, 4. PA config, 5. set_tx_power and
     # 6. set_buffer_base_addr
-    set_buffer_base_addr()
+    configure()
 
     # 7. write buffer
     write_buffer(0, b'hi there')
 
-    # 8. set modulation params
-    set_modulation_params()
-
-    # 9. set packet params
-    set_packet_params(8)
+    # 8. set modulation params and 9. set packet params
+    configure_tx(8)
 
     # 10. config DIO and IRQ
     # 11. sync word